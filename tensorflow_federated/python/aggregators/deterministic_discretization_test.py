@@ -49,6 +49,20 @@ def _make_test_nested_struct_value(value):
   )
 
 
+def _undiscretize(struct, step_size, tf_dtype_struct):
+  """Undiscretizes via the leaf closures used by the shipped computation."""
+  leaf_fns = tf.nest.flatten(
+      deterministic_discretization._build_undiscretize_leaf_fns(
+          tf_dtype_struct
+      )
+  )
+  step_size = tf.cast(step_size, tf.float32)
+  return tf.nest.pack_sequence_as(
+      struct,
+      [fn(x, step_size) for fn, x in zip(leaf_fns, tf.nest.flatten(struct))],
+  )
+
+
 def _named_test_cases_product(*args):
   """Utility for creating parameterized named test cases."""
   named_cases = []
@@ -87,9 +101,13 @@ class DeterministicDiscretizationComputationTest(
     process = factory.create(value_type)
     self.assertIsInstance(process, aggregation_process.AggregationProcess)
 
-    server_state_type = computation_types.StructType(
-        [('step_size', np.float32), ('inner_agg_process', ())]
-    )
+    server_state_type = computation_types.StructType([
+        ('step_size', np.float32),
+        ('inner_agg_process', ()),
+        # State of the distortion `UnweightedMeanFactory`: a value sum and
+        # a count sum process state.
+        ('distortion_state', ((), ())),
+    ])
     server_state_type = computation_types.at_server(server_state_type)
     expected_initialize_type = computation_types.FunctionType(
         parameter=None, result=server_state_type
@@ -134,6 +152,32 @@ class DeterministicDiscretizationComputationTest(
     value_type = computation_types.to_type(value_type)
     self.assertRaises(TypeError, factory.create, value_type)
 
+  def test_raises_on_non_integer_output_dtype(self):
+    with self.assertRaises(TypeError):
+      deterministic_discretization.DeterministicDiscretizationFactory(
+          inner_agg_factory=_measurement_aggregator,
+          step_size=0.1,
+          output_dtype=tf.float32,
+      )
+
+  def test_raises_on_per_tensor_scale_without_expected_num_clients(self):
+    with self.assertRaises(ValueError):
+      deterministic_discretization.DeterministicDiscretizationFactory(
+          inner_agg_factory=_measurement_aggregator,
+          step_size=0.1,
+          per_tensor_scale=True,
+      )
+
+  def test_raises_on_per_tensor_scale_with_wide_output_dtype(self):
+    with self.assertRaises(TypeError):
+      deterministic_discretization.DeterministicDiscretizationFactory(
+          inner_agg_factory=_measurement_aggregator,
+          step_size=0.1,
+          per_tensor_scale=True,
+          expected_num_clients=2,
+          output_dtype=tf.int32,
+      )
+
   @parameterized.named_parameters(
       ('plain_struct', [('a', np.int32)]),
       ('sequence', computation_types.SequenceType(np.int32)),
@@ -201,6 +245,72 @@ class DeterministicDiscretizationExecutionTest(
       result = output.result
       self.assertAllClose(result, expected_result)
 
+  def test_discretize_impl_per_tensor_scale(self):
+    factory = deterministic_discretization.DeterministicDiscretizationFactory(
+        inner_agg_factory=_measurement_aggregator,
+        step_size=0.1,
+        per_tensor_scale=True,
+        expected_num_clients=2,
+    )
+    value_type = computation_types.to_type((np.float32, [4]))
+    process = factory.create(value_type)
+    state = process.initialize()
+
+    # With the default int8 payload and two clients, each tensor scales to
+    # [-63, 63] so the two-client sum stays within int8. Identical client
+    # values give identical per-tensor scales, so the mean scale
+    # undiscretizes the sum without cross-client approximation.
+    client_value = np.array([0.0, 1.0, 2.0, 3.0], np.float32)
+    output = process.next(state, [client_value, client_value])
+    self.assertAllClose(output.result, client_value * 2, atol=1e-4)
+
+  def test_discretize_impl_narrow_output_dtype(self):
+    factory = deterministic_discretization.DeterministicDiscretizationFactory(
+        inner_agg_factory=_measurement_aggregator,
+        step_size=0.1,
+        value_range=6.0,
+        expected_num_clients=2,
+    )
+    value_type = computation_types.to_type((np.float32, [4]))
+    process = factory.create(value_type)
+    state = process.initialize()
+
+    # value_range / step_size * expected_num_clients = 120, so the payload
+    # is discretized and summed across clients in int8.
+    client_value = np.array([0.0, 1.0, 2.0, 3.0], np.float32)
+    output = process.next(state, [client_value, client_value])
+    self.assertAllClose(output.result, client_value * 2)
+    quantized_sum = output.measurements['deterministic_discretization']
+    self.assertEqual(np.asarray(quantized_sum).dtype, np.int8)
+    self.assertAllEqual(quantized_sum, (client_value * 20).astype(np.int8))
+
+  @parameterized.named_parameters(
+      ('plain', None),
+      ('with_distortion', mean.UnweightedMeanFactory()),
+  )
+  def test_assert_output_range_impl(self, distortion_aggregation_factory):
+    factory = deterministic_discretization.DeterministicDiscretizationFactory(
+        inner_agg_factory=_measurement_aggregator,
+        step_size=0.1,
+        distortion_aggregation_factory=distortion_aggregation_factory,
+        output_dtype=tf.int8,
+        expected_num_clients=2,
+        assert_output_range=True,
+    )
+    value_type = computation_types.to_type((np.float32, [2]))
+    process = factory.create(value_type)
+    state = process.initialize()
+
+    # Scaled magnitudes of 60 leave headroom for the two-client sum in int8.
+    in_range = np.array([0.0, 6.0], np.float32)
+    output = process.next(state, [in_range, in_range])
+    self.assertAllClose(output.result, in_range * 2)
+
+    # Scaled magnitudes of 100 per client overflow int8 once summed.
+    out_of_range = np.array([0.0, 10.0], np.float32)
+    with self.assertRaisesRegex(Exception, 'overflow the configured'):
+      process.next(state, [out_of_range, out_of_range])
+
   @parameterized.named_parameters(
       ('int32', np.int32), ('int64', np.int64), ('float64', np.float64)
   )
@@ -214,6 +324,42 @@ class DeterministicDiscretizationExecutionTest(
         encoded_x.dtype, deterministic_discretization.OUTPUT_TF_TYPE
     )
 
+  def test_discretize_struct_with_repeated_shapes(self):
+    """Checks leaves sharing a shape are restored to their positions."""
+    struct = collections.OrderedDict(
+        a=tf.constant([1.0, 2.0]),
+        b=tf.constant([3.0, 4.0]),
+        c=tf.constant(5.0),
+    )
+    encoded = deterministic_discretization._discretize_struct(
+        struct, step_size=0.5
+    )
+    expected = collections.OrderedDict(
+        a=[2, 4],
+        b=[6, 8],
+        c=10,
+    )
+    self.assertAllClose(expected, self.evaluate(encoded))
+
+  @parameterized.named_parameters(
+      ('int8', 100, tf.int8),
+      ('int16', 10**4, tf.int16),
+      ('int32', 10**8, tf.int32),
+  )
+  def test_smallest_output_dtype(self, max_scaled_magnitude, expected_dtype):
+    """Checks the narrowest dtype is selected for a given scaled range."""
+    self.assertEqual(
+        deterministic_discretization._smallest_output_dtype(
+            max_scaled_magnitude
+        ),
+        expected_dtype,
+    )
+    x = tf.range(8, dtype=np.float32)
+    encoded_x = deterministic_discretization._discretize_struct(
+        x, step_size=1.0, output_dtype=expected_dtype
+    )
+    self.assertEqual(encoded_x.dtype, expected_dtype)
+
   @parameterized.named_parameters(
       ('int32', np.int32), ('int64', np.int64), ('float64', np.float64)
   )
@@ -221,9 +367,7 @@ class DeterministicDiscretizationExecutionTest(
     """Checks that postprocessing restores the original dtype."""
     x = tf.range(8, dtype=dtype)
     encoded_x = deterministic_discretization._discretize_struct(x, step_size=1)
-    decoded_x = deterministic_discretization._undiscretize_struct(
-        encoded_x, step_size=1, tf_dtype_struct=dtype
-    )
+    decoded_x = _undiscretize(encoded_x, step_size=1, tf_dtype_struct=dtype)
     self.assertEqual(dtype, decoded_x.dtype)
 
 
@@ -243,9 +387,7 @@ class QuantizationTest(tf.test.TestCase, parameterized.TestCase):
   def test_error_from_rounding(self, step_size, shape):
     x = tf.random.uniform(shape=shape, minval=-10, maxval=10, dtype=tf.float32)
     encoded_x = deterministic_discretization._discretize_struct(x, step_size)
-    decoded_x = deterministic_discretization._undiscretize_struct(
-        encoded_x, step_size, tf_dtype_struct=np.float32
-    )
+    decoded_x = _undiscretize(encoded_x, step_size, tf_dtype_struct=np.float32)
     x, decoded_x = self.evaluate([x, decoded_x])
 
     self.assertAllEqual(x.shape, decoded_x.shape)
@@ -265,7 +407,7 @@ class ScalingTest(tf.test.TestCase, parameterized.TestCase):
     discretized_x = deterministic_discretization._discretize_struct(
         x, tf.cast(step_size, np.float32)
     )
-    reverted_x = deterministic_discretization._undiscretize_struct(
+    reverted_x = _undiscretize(
         discretized_x, step_size, tf_dtype_struct=np.int32
     )
     x, discretized_x, reverted_x = self.evaluate([x, discretized_x, reverted_x])